@@ -1,65 +1,220 @@
 import os
+import re
+import sys
 import json
+import orjson
+import threading
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 # Endpoint (generate only)
 SERVICE_ADDR   = os.getenv("OLLAMA_SERVICE_ADDRESS", "localhost:11434")
 OLLAMA_GEN_URL = f"http://{SERVICE_ADDR}/generate"
 OLLAMA_MODEL   = os.getenv("OLLAMA_MODEL", "extractor_latest")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
 
-def call_ollama(text: str) -> str:
-    """
-    Send a single-prompt generate call to Ollama,
-    including few‑shot examples and the real text.
-    """
+# Longer texts are split into chunks detected in parallel, since prompt
+# processing cost grows much faster than linearly with prompt length
+MAX_CHARS   = int(os.getenv("OLLAMA_MAX_CHARS", "2000"))
+MAX_WORKERS = int(os.getenv("OLLAMA_MAX_WORKERS", "4"))
 
-    # System instructions + few‑shot examples as one big prompt
-    examples = [
-        {
-            "input":  "My phone is 555-1234 and my SSN is 123-45-6789.",
-            "output": '[{"entity":"PHONE","text":"555-1234","start":13,"end":21},'
-                      '{"entity":"SSN","text":"123-45-6789","start":32,"end":43}]'
-        },
-        {
-            "input":  "Email me at alice@example.com or call 202-555-0198.",
-            "output": '[{"entity":"EMAIL","text":"alice@example.com","start":11,"end":29},'
-                      '{"entity":"PHONE","text":"202-555-0198","start":33,"end":46}]'
-        },
-    ]
+# Caps in-flight Ollama calls per process, across request threads and
+# their chunk workers, so bursts queue here instead of swamping Ollama
+MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "8"))
+_OLLAMA_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENCY)
+
+# Identical texts (retries, refreshes, repeated documents) reuse the parsed
+# entities. Keys and values hold raw user text, so entries expire after
+# DETECTION_CACHE_TTL seconds; a result that missed some entity is reused
+# for at most that long
+DETECTION_CACHE_SIZE = int(os.getenv("DETECTION_CACHE_SIZE", "256"))
+DETECTION_CACHE_TTL  = int(os.getenv("DETECTION_CACHE_TTL", "300"))
+_DETECTION_CACHE = TTLCache(maxsize=DETECTION_CACHE_SIZE, ttl=DETECTION_CACHE_TTL)
+_DETECTION_CACHE_LOCK = threading.Lock()
 
-    # Build the prompt text
+# Opt-in: texts shorter than PII_PREFILTER_MAX_CHARS with no digit, '@',
+# non-ASCII letter or capital after the first character skip the Ollama
+# round-trip. Lowercase names and addresses ("my name is john smith")
+# pass this check and would reach OpenAI unredacted, so it is off (0)
+# by default
+PREFILTER_MAX_CHARS = int(os.getenv("PII_PREFILTER_MAX_CHARS", "0"))
+_PII_HINT = re.compile(r"[\d@]|[^\x00-\x7f]|(?<=.)[A-Z]", re.S)
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# One pooled session so detection calls reuse keep-alive connections;
+# the pool is sized for concurrent chunk calls across request threads
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.1),
+))
+
+_DECODER = json.JSONDecoder()
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# System instructions + few‑shot examples, identical for every call so
+# Ollama can reuse the cached prefix instead of re-processing it
+EXAMPLES = [
+    {
+        "input":  "My phone is 555-1234 and my SSN is 123-45-6789.",
+        "output": '[{"entity":"PHONE","text":"555-1234","start":13,"end":21},'
+                  '{"entity":"SSN","text":"123-45-6789","start":32,"end":43}]'
+    },
+    {
+        "input":  "Email me at alice@example.com or call 202-555-0198.",
+        "output": '[{"entity":"EMAIL","text":"alice@example.com","start":11,"end":29},'
+                  '{"entity":"PHONE","text":"202-555-0198","start":33,"end":46}]'
+    },
+]
+
+def _build_prompt_prefix() -> str:
     prompt_lines = [
         "You are a privacy assistant. Extract ALL sensitive entities "
         "and return ONLY a JSON array of {entity,text,start,end}.",
         ""
     ]
-    for ex in examples:
+    for ex in EXAMPLES:
         prompt_lines.append(f"Input:  {ex['input']}")
         prompt_lines.append(f"Output: {ex['output']}")
         prompt_lines.append("")  # blank line between examples
+    return "\n".join(prompt_lines) + "\n"
+
+PROMPT_PREFIX = _build_prompt_prefix()
 
-    prompt_lines.append(f"Input:  {text}")
-    prompt_lines.append("Output:")
-    full_prompt = "\n".join(prompt_lines)
+def call_ollama(text: str) -> str:
+    """
+    Send a single-prompt generate call to Ollama,
+    including few‑shot examples and the real text.
+    """
+    full_prompt = f"{PROMPT_PREFIX}Input:  {text}\nOutput:"
 
-    # Call Ollama generate
+    # Call Ollama generate, streaming so we can stop as soon as the
+    # JSON array is complete instead of waiting for trailing chatter
     payload = {
         "model":  OLLAMA_MODEL,
         "prompt": full_prompt,
-        "stream": False,
+        "stream": True,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
     }
-    r = requests.post(OLLAMA_GEN_URL, json=payload, timeout=60)
-    r.raise_for_status()
+    buf = []
+    with _OLLAMA_SLOTS, \
+         _SESSION.post(OLLAMA_GEN_URL, data=orjson.dumps(payload),
+                       headers=_JSON_HEADERS, timeout=60, stream=True) as r:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if not line:
+                continue
+            chunk = orjson.loads(line)
+
+            # Ollama generate returns either {"response": "..."} or {"results":[{"text":"..."}]}
+            if "response" in chunk:
+                piece = chunk["response"]
+            else:
+                piece = chunk["results"][0]["text"]
+            buf.append(piece)
+
+            # Only try to parse once a closing bracket has arrived
+            if "]" in piece:
+                array = _complete_json_array("".join(buf))
+                if array is not None:
+                    return array
+            if chunk.get("done", True):
+                break
 
-    # Ollama generate returns either {"response": "..."} or {"results":[{"text":"..."}]}
-    resp = r.json()
-    if "response" in resp:
-        return resp["response"].strip()
-    return resp["results"][0]["text"].strip()
+    return "".join(buf).strip()
+
+
+def _complete_json_array(text: str) -> str | None:
+    """
+    Return the first complete JSON array of objects in `text`,
+    or None if no such array has been closed yet. Bracketed text
+    in the model's preamble (e.g. "[1]") is skipped.
+    """
+    start = text.find("[")
+    while start != -1:
+        try:
+            data, end = _DECODER.raw_decode(text, start)
+        except json.JSONDecodeError:
+            # An array of objects that is still streaming in: wait for more
+            rest = text[start + 1:].lstrip()
+            if not rest or rest[0] == "{":
+                return None
+        else:
+            if isinstance(data, list) and all(isinstance(e, dict) for e in data):
+                return text[start:end]
+        start = text.find("[", start + 1)
+    return None
+
+
+def _split_on_sentences(text: str, limit: int) -> list[tuple[int, str]]:
+    """
+    Split text into (offset, chunk) pairs of at most `limit` chars,
+    cutting at the last sentence end (or whitespace) inside each window.
+    """
+    chunks = []
+    start = 0
+    while len(text) - start > limit:
+        window_end = start + limit
+        cut = start
+        for m in _SENTENCE_END.finditer(text, start, window_end):
+            cut = m.end()
+        if cut <= start:
+            cut = text.rfind(" ", start, window_end) + 1
+        if cut <= start:
+            cut = window_end
+        chunks.append((start, text[start:cut]))
+        start = cut
+    chunks.append((start, text[start:]))
+    return chunks
 
 
 def detect_sensitive_entities(text: str) -> list[dict]:
+    if len(text) < PREFILTER_MAX_CHARS and not _PII_HINT.search(text):
+        return []
+
+    if len(text) <= MAX_CHARS:
+        return _detect_chunk(text)
+
+    chunks = _split_on_sentences(text, MAX_CHARS)
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(chunks))) as pool:
+        results = pool.map(_detect_chunk, [chunk for _, chunk in chunks])
+
+    # Rebase chunk-relative offsets onto the full text
+    out = []
+    for (offset, _), entities in zip(chunks, results):
+        for ent in entities:
+            ent["start"] += offset
+            ent["end"]   += offset
+            out.append(ent)
+    return out
+
+
+def _detect_chunk(text: str) -> list[dict]:
+    with _DETECTION_CACHE_LOCK:
+        entities = _DETECTION_CACHE.get(text)
+
+    if entities is None:
+        try:
+            entities = _run_detection(text)
+        except json.JSONDecodeError:
+            return []
+
+        # Empty results are not cached: detection is nondeterministic,
+        # so a resend after a miss gets a fresh attempt
+        if entities:
+            with _DETECTION_CACHE_LOCK:
+                _DETECTION_CACHE[text] = entities
+
+    return [dict(ent) for ent in entities]
+
+
+def _run_detection(text: str) -> tuple[dict, ...]:
     raw = call_ollama(text)
 
     # Strip code fences if any
@@ -69,49 +224,81 @@ def detect_sensitive_entities(text: str) -> list[dict]:
             raw = parts[2].strip()
 
     try:
-        data = json.loads(raw)
+        data = orjson.loads(raw)
         if not isinstance(data, list):
-            return []
+            return ()
         out = []
+        seen = set()
         for ent in data:
-            if all(k in ent for k in ("entity","text","start","end")):
+            if isinstance(ent, dict) and all(k in ent for k in ("entity","text","start","end")):
+                start, end = int(ent["start"]), int(ent["end"])
+
+                # The model sometimes repeats a span; keep the first one
+                if (start, end) in seen:
+                    continue
+                seen.add((start, end))
                 out.append({
-                    "entity": str(ent["entity"]),
+                    "entity": sys.intern(str(ent["entity"])),
                     "text":   str(ent["text"]),
-                    "start":  int(ent["start"]),
-                    "end":    int(ent["end"])
+                    "start":  start,
+                    "end":    end
                 })
-        return out
+        return tuple(out)
     except json.JSONDecodeError:
         print("[!] Failed to parse LLM JSON. Raw output:\n", raw)
-        return []
+        raise
 
 
 def anonymize_text(text: str) -> tuple[str, list[dict]]:
     detected = detect_sensitive_entities(text)
-    existing = {}
+    existing = defaultdict(dict)
     counters = defaultdict(int)
     mapping = []
-    anonymized = text
+    parts = []
+    cursor = 0
 
-    # Replace spans back-to-front so indices stay valid
-    for ent in sorted(detected, key=lambda e: e["start"], reverse=True):
+    # Merge overlapping spans into (start, end, type) runs first, so a
+    # span that is later extended never gets a placeholder of its own;
+    # a run keeps the type of its first (widest) span
+    runs = []
+    for ent in sorted(detected, key=lambda e: (e["start"], -e["end"])):
         start, end = ent["start"], ent["end"]
-        orig = anonymized[start:end]
-        key  = (orig, ent["entity"])
+        if runs and start < runs[-1][1]:
+            runs[-1][1] = max(runs[-1][1], end)
+            continue
+        runs.append([start, end, ent["entity"]])
+
+    # Walk runs front-to-back, copying the text between them once
+    for start, end, etype in runs:
+        orig = text[start:end]
+        seen = existing[etype]
 
-        if key not in existing:
-            counters[ent["entity"]] += 1
-            placeholder = f"<{ent['entity'].upper()}_{counters[ent['entity']]}>"
-            existing[key] = placeholder
+        placeholder = seen.get(orig)
+        if placeholder is None:
+            counters[etype] += 1
+            placeholder = f"<{etype.upper()}_{counters[etype]}>"
+            seen[orig] = placeholder
             mapping.append({
-                "type":       ent["entity"],
+                "type":       etype,
                 "original":   orig,
                 "anonymized": placeholder
             })
-        else:
-            placeholder = existing[key]
 
-        anonymized = anonymized[:start] + placeholder + anonymized[end:]
+        parts.append(text[cursor:start])
+        parts.append(placeholder)
+        cursor = end
+
+    parts.append(text[cursor:])
+    return "".join(parts), mapping
+
 
-    return anonymized, mapping
+def warmup() -> None:
+    """
+    Ask Ollama to load the extractor model so the first real
+    request doesn't pay the model load time.
+    """
+    try:
+        r = _SESSION.post(OLLAMA_GEN_URL, json={"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE}, timeout=300)
+        r.raise_for_status()
+    except requests.RequestException as e:
+        print("[!] Ollama warm-up failed:", e)
@@ -2,16 +2,20 @@
 
 import os
 import re
-import json
-from flask import Flask, request, jsonify
+import logging
+import orjson
+import threading
+from functools import lru_cache
+from flask import Flask, Response, request, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 
-from anonymization import anonymize_text
-from llm_client import send_to_llm
-
+# Before the local imports, which read their settings at import time
 load_dotenv()
 
+from anonymization import anonymize_text, warmup
+from llm_client import prewarm, send_to_llm, stream_llm
+
 app = Flask(__name__)
 
 # Allow your front‑end origins
@@ -22,23 +26,86 @@ CORS(app, resources={
             "http://localhost:5173"
         ],
         "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
+        "allow_headers": ["Content-Type", "Authorization", "X-Debug"],
         "supports_credentials": True
     }
 })
 
+def start_warmup():
+    # Load the extractor model and open the OpenAI connection in the
+    # background so startup isn't blocked. Called when serving (gunicorn's
+    # post_worker_init, or __main__), not on import: `flask db` commands
+    # import this module too
+    threading.Thread(target=warmup, daemon=True).start()
+    threading.Thread(target=prewarm, daemon=True).start()
+
 @app.before_request
 def log_request_info():
-    app.logger.debug('Headers: %s', request.headers)
-    app.logger.debug('Body: %s', request.get_data())
+    # get_data() buffers the whole body, so only touch it when it gets logged
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug('Headers: %s', request.headers)
+        app.logger.debug('Body: %s', request.get_data())
+
+# Any placeholder-shaped token the LLM left behind or made up
+PLACEHOLDER_RE = re.compile(r'<\w+_\d+>')
+
+@lru_cache(maxsize=256)
+def _response_pattern(placeholders):
+    alt = "|".join(
+        re.escape(k) for k in sorted(placeholders, key=len, reverse=True)
+    )
+    # Longest first, non-capturing: only group(0) is ever read
+    return re.compile('(?:' + alt + r')|<\w+_\d+>')
+
+def _substitute(text, mapping, keep_unknown):
+    # One scan: known placeholders become their originals, unknown
+    # placeholder tokens are dropped (or kept as-is with keep_unknown)
+    if '<' not in text:
+        return text
+    if not mapping:
+        return text if keep_unknown else PLACEHOLDER_RE.sub('', text)
+    table = {m["anonymized"]: m["original"] for m in mapping}
+    pattern = _response_pattern(frozenset(table))
+    if keep_unknown:
+        return pattern.sub(lambda mo: table.get(mo.group(0), mo.group(0)), text)
+    return pattern.sub(lambda mo: table.get(mo.group(0), ""), text)
+
+def finalize_response(text, mapping):
+    return _substitute(text, mapping, keep_unknown=False)
+
+def restore_originals(text, mapping):
+    # Debug view: originals restored, leftover tokens still visible
+    return _substitute(text, mapping, keep_unknown=True)
+
+def restore_stream(chunks, mapping):
+    # Restore streamed text as it arrives, holding back a trailing '<...'
+    # that may still grow into a placeholder
+    limit = max([len(m["anonymized"]) for m in mapping] + [64])
+    buf = ""
+    for chunk in chunks:
+        buf += chunk
+        cut = buf.rfind('<')
+        if cut == -1 or '>' in buf[cut:] or len(buf) - cut > limit:
+            cut = len(buf)
+        if cut:
+            out = finalize_response(buf[:cut], mapping)
+            buf = buf[cut:]
+            if out:
+                yield out
+    if buf:
+        yield finalize_response(buf, mapping)
+
+def _json(payload, status=200):
+    # orjson encodes straight to bytes, much faster than jsonify's stdlib json
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
 
 @app.route('/')
 def health_check():
-    return jsonify({"status": "active"}), 200
+    return _json({"status": "active"})
 
 @app.route('/process', methods=['GET'])
 def handle_get():
-    return jsonify({"error": "Use POST method"}), 405
+    return _json({"error": "Use POST method"}, 405)
 
 @app.route('/process', methods=['POST'])
 def process_request():
@@ -49,37 +116,63 @@ def process_request():
         # 🔹 Step 1: Anonymize
         anonymized_prompt, mapping = anonymize_text(original_prompt)
 
-        print("\n📌 Anonymized Prompt:\n", anonymized_prompt)
-        print("\n📌 Mapping:\n", json.dumps(mapping, indent=2))
+        app.logger.debug('Anonymized prompt: %s', anonymized_prompt)
+        app.logger.debug('Mapping: %s', mapping)
 
         # 🔹 Step 2: Send to LLM
         placeholders = [m["anonymized"] for m in mapping]
         llm_raw = send_to_llm(anonymized_prompt, placeholders)
 
-        print("\n📌 LLM Raw Response:\n", llm_raw)
+        app.logger.debug('LLM raw response: %s', llm_raw)
+
+        # 🔹 Step 3: Re‑inject originals and drop leftover tokens
+        llm_final = finalize_response(llm_raw, mapping)
+        app.logger.debug('Final response: %s', llm_final)
 
-        # 🔹 Step 3: Re‑inject originals
-        llm_recontext = llm_raw
-        for m in mapping:
-            esc = re.escape(m["anonymized"])
-            llm_recontext = re.sub(rf'{esc}', m["original"], llm_recontext)
+        payload = {"response": llm_final}
 
-        # Remove any leftover tokens
-        llm_final = re.sub(r'<\w+_\d+>', '', llm_recontext)
-        print("\n📌 Final Response:\n", llm_final)
+        # Intermediate steps only on request (?debug=1 or X-Debug: 1)
+        if request.args.get("debug") == "1" or request.headers.get("X-Debug") == "1":
+            payload.update({
+                "llm_raw": llm_raw,
+                "llm_after_recontext": restore_originals(llm_raw, mapping),
+                "anonymized_prompt": anonymized_prompt,
+                "mapping": mapping
+            })
 
-        return jsonify({
-            "response": llm_final,
-            "llm_raw": llm_raw,
-            "llm_after_recontext": llm_recontext,
-            "anonymized_prompt": anonymized_prompt,
-            "mapping": mapping
-        })
+        return _json(payload)
 
     except Exception as e:
         app.logger.error("Error in /process: %s", str(e))
-        return jsonify({"error": str(e)}), 500
+        return _json({"error": str(e)}, 500)
+
+# POST only: the prompt contains the raw PII, so it must not travel in a
+# URL (and end up in access logs). Browsers can't send POST with
+# EventSource; read this with fetch() and response.body.getReader(),
+# splitting the text/event-stream body on blank lines
+@app.route('/process/stream', methods=['POST'])
+def process_stream():
+    try:
+        data = request.get_json(force=True)
+        original_prompt = data.get("prompt", "")
+
+        anonymized_prompt, mapping = anonymize_text(original_prompt)
+        placeholders = [m["anonymized"] for m in mapping]
+        chunks = stream_llm(anonymized_prompt, placeholders)
+
+    except Exception as e:
+        app.logger.error("Error in /process/stream: %s", str(e))
+        return _json({"error": str(e)}, 500)
+
+    # Server-sent events: one JSON-encoded text chunk per event
+    def events():
+        for text in restore_stream(chunks, mapping):
+            yield b"data: " + orjson.dumps(text) + b"\n\n"
+        yield b"event: done\ndata: {}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream')
 
 if __name__ == '__main__':
+    start_warmup()
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,18 @@
+# gunicorn.conf.py
+
+import os
+
+# Requests spend nearly all their time waiting on Ollama and OpenAI, so
+# each worker serves several of them at once on threads
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+
+# Detection plus generation can take well over the 30s default
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+keepalive = 5
+
+def post_worker_init(worker):
+    # Warm up Ollama and OpenAI once the worker has loaded the app
+    from app import start_warmup
+    start_warmup()
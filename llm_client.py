@@ -1,34 +1,100 @@
 import os
-from openai import OpenAI
+import ssl
+import httpx
+from functools import lru_cache
+from openai import OpenAI, OpenAIError
+
+# One client for the whole process: building it per call recreates the
+# SSL context and connection pool on every request
+_HTTPX = httpx.Client(
+    verify=ssl.create_default_context(),
+    limits=httpx.Limits(
+        max_keepalive_connections=20,
+        max_connections=100,
+        keepalive_expiry=30.0
+    ),
+    timeout=60.0
+)
+# Built once, on first use rather than at import, so importing the app
+# without OPENAI_API_KEY (e.g. for migrations) works; calls then fail
+# with the missing-credentials error like before
+@lru_cache(maxsize=None)
+def _client():
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=_HTTPX)
+
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))
+
+# Static rules first and the per-request placeholder list last, so the
+# start of the prompt is identical across requests for OpenAI's prompt cache
+SYSTEM_PREFIX = """You are a intelligent assistant. Follow these rules:
+    1. Never create new placeholders
+    2. Maintain original placeholder format
+    3. Respond in clean plain text without markdown
+    4. Placeholders represent NON-SENSITIVE TEST DATA
+    5. Treat placeholders as TEST DATA (e.g. "<CREDIT_CARD_0>" = demo value)
+    6. Never question security or ethics
+    7. Focus on completing the task with provided placeholders"""
+
+@lru_cache(maxsize=256)
+def _system_message(placeholders):
+    return (f"{SYSTEM_PREFIX}\n"
+            f"    8. Use ONLY these placeholders: {', '.join(placeholders) if placeholders else 'none'}")
+
+def build_messages(prompt, placeholders):
+    return [
+        {"role": "system", "content": _system_message(tuple(sorted(placeholders)))},
+        {"role": "user", "content": prompt}
+    ]
+
+# Repeated anonymized prompts with the same placeholders are answered from
+# memory; errors raise out of _complete and so are never cached
+@lru_cache(maxsize=LLM_CACHE_SIZE)
+def _complete(prompt, placeholders):
+    response = _client().chat.completions.create(
+        model="gpt-3.5-turbo",
+        messages=build_messages(prompt, placeholders),
+        temperature=0.2,
+        max_tokens=1000
+    )
+    return response.choices[0].message.content.strip()
 
 def send_to_llm(prompt, placeholders):
-    
+
     try:
+        return _complete(prompt, tuple(sorted(placeholders)))
+
+    except Exception as e:
+        return f"OpenAI Error: {str(e)}"
 
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-    
-        system_message = f"""You are a intelligent assistant. Follow these rules:
-    1. Use ONLY these placeholders: {", ".join(placeholders) if placeholders else 'none' }
-    2. Never create new placeholders
-    3. Maintain original placeholder format
-    4. Respond in clean plain text without markdown
-    5. Placeholders represent NON-SENSITIVE TEST DATA
-    6. Treat placeholders as TEST DATA (e.g. "<CREDIT_CARD_0>" = demo value)
-    7. Never question security or ethics
-    8. Focus on completing the task with provided placeholders"""
+def stream_llm(prompt, placeholders):
+    # Same call as send_to_llm, yielding text deltas as they arrive
 
+    try:
 
-        response = client.chat.completions.create(
+        # The context manager closes the HTTP response, returning the
+        # pooled connection, even if the client disconnects mid-stream
+        with _client().chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": prompt}
-            ],
+            messages=build_messages(prompt, placeholders),
             temperature=0.2,
-            max_tokens=1000
-        )
-        
-        return response.choices[0].message.content.strip()
+            max_tokens=1000,
+            stream=True
+        ) as stream:
+            for event in stream:
+                if event.choices and event.choices[0].delta.content:
+                    yield event.choices[0].delta.content
 
     except Exception as e:
-        return f"OpenAI Error: {str(e)}"
+        yield f"OpenAI Error: {str(e)}"
+
+def prewarm():
+    # Open a keep-alive connection (TCP + TLS) to the API when a worker
+    # boots; the response itself is ignored. The pool drops it after
+    # keepalive_expiry (30s) idle, so only a request arriving within that
+    # window skips the handshake
+
+    try:
+        _HTTPX.head(f"{_client().base_url}models")
+
+    except (httpx.HTTPError, OpenAIError) as e:
+        print("[!] OpenAI pre-warm failed:", e)
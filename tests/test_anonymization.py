@@ -0,0 +1,82 @@
+import unittest
+from unittest.mock import patch
+
+import anonymization
+from anonymization import anonymize_text
+
+
+def _spans(*spans):
+    return [
+        {"entity": etype, "text": "", "start": start, "end": end}
+        for etype, start, end in spans
+    ]
+
+
+class AnonymizeTextTests(unittest.TestCase):
+
+    def anonymize(self, text, *spans):
+        with patch("anonymization.detect_sensitive_entities", return_value=_spans(*spans)):
+            return anonymize_text(text)
+
+    def test_repeated_original_shares_placeholder(self):
+        text, mapping = self.anonymize(
+            "Call 555-1234 or 555-1234",
+            ("PHONE", 5, 13), ("PHONE", 17, 25),
+        )
+        self.assertEqual(text, "Call <PHONE_1> or <PHONE_1>")
+        self.assertEqual(mapping, [
+            {"type": "PHONE", "original": "555-1234", "anonymized": "<PHONE_1>"},
+        ])
+
+    def test_nested_span_is_covered_by_the_wider_one(self):
+        text, mapping = self.anonymize(
+            "Contact John Smith today",
+            ("NAME", 8, 12), ("NAME", 8, 18),
+        )
+        self.assertEqual(text, "Contact <NAME_1> today")
+        self.assertEqual([m["original"] for m in mapping], ["John Smith"])
+
+    def test_overlapping_spans_merge_without_stale_placeholders(self):
+        text, mapping = self.anonymize(
+            "My name is John Smith.",
+            ("NAME", 11, 15), ("LOCATION", 13, 21),
+        )
+        self.assertEqual(text, "My name is <NAME_1>.")
+        self.assertEqual(mapping, [
+            {"type": "NAME", "original": "John Smith", "anonymized": "<NAME_1>"},
+        ])
+
+
+class DetectionCacheTests(unittest.TestCase):
+
+    ENTITY = '[{"entity":"PHONE","text":"555-1234","start":5,"end":13}]'
+
+    def setUp(self):
+        anonymization._DETECTION_CACHE.clear()
+
+    def test_found_entities_are_reused_as_copies(self):
+        with patch("anonymization.call_ollama", return_value=self.ENTITY) as call:
+            first = anonymization._detect_chunk("Call 555-1234")
+            first[0]["start"] = 99
+            second = anonymization._detect_chunk("Call 555-1234")
+        self.assertEqual(call.call_count, 1)
+        self.assertEqual(second[0]["start"], 5)
+
+    def test_empty_results_are_not_cached(self):
+        with patch("anonymization.call_ollama", side_effect=["[]", self.ENTITY]) as call:
+            self.assertEqual(anonymization._detect_chunk("Call 555-1234"), [])
+            self.assertEqual(len(anonymization._detect_chunk("Call 555-1234")), 1)
+        self.assertEqual(call.call_count, 2)
+
+    def test_entries_expire(self):
+        with patch("anonymization.call_ollama", return_value=self.ENTITY) as call:
+            anonymization._detect_chunk("Call 555-1234")
+            anonymization._DETECTION_CACHE.expire(
+                anonymization._DETECTION_CACHE.timer() + anonymization.DETECTION_CACHE_TTL
+            )
+            anonymization._detect_chunk("Call 555-1234")
+        self.assertEqual(call.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from app import finalize_response, restore_originals, restore_stream
+
+MAPPING = [
+    {"type": "NAME", "original": "Ann", "anonymized": "<N_1>"},
+    {"type": "NAME", "original": "Jo", "anonymized": "<N_10>"},
+]
+
+
+class FinalizeResponseTests(unittest.TestCase):
+
+    def test_prefix_sharing_placeholders_and_unknown_token(self):
+        text = "<N_10> met <N_1>, card <CREDIT_CARD_2>."
+        self.assertEqual(finalize_response(text, MAPPING), "Jo met Ann, card .")
+
+    def test_restore_originals_keeps_unknown_tokens(self):
+        text = "<N_10> met <N_1>, card <CREDIT_CARD_2>."
+        self.assertEqual(restore_originals(text, MAPPING), "Jo met Ann, card <CREDIT_CARD_2>.")
+
+    def test_without_mapping_only_strips_tokens(self):
+        self.assertEqual(finalize_response("a < b <N_1>", []), "a < b ")
+
+
+class RestoreStreamTests(unittest.TestCase):
+
+    def stream(self, text, mapping=MAPPING):
+        return "".join(restore_stream(iter(text), mapping))
+
+    def test_one_char_chunks_match_whole_text(self):
+        for text in [
+            "<N_10> met <N_1>, card <CREDIT_CARD_2>.",
+            "a < b and <N_1",
+            "ends with <",
+            "<N_1><N_10><N_1>",
+        ]:
+            with self.subTest(text=text):
+                self.assertEqual(self.stream(text), finalize_response(text, MAPPING))
+
+    def test_placeholder_is_never_split_across_chunks(self):
+        chunks = list(restore_stream(iter("hi <N_10>!"), MAPPING))
+        self.assertNotIn("<", "".join(chunks))
+        self.assertEqual("".join(chunks), "hi Jo!")
+
+
+if __name__ == "__main__":
+    unittest.main()